@@ -1,26 +1,135 @@
-import requests
+import httpx
+import atexit
 import json
-from googleapiclient.discovery import build
 import pandas as pd
 from datetime import datetime, timedelta
 import streamlit as st
 from io import BytesIO
-from openpyxl.styles import Alignment, Font, PatternFill, Border, Side
-from openpyxl.drawing.image import Image as OpxImage
+import xlsxwriter
+from PIL import Image
 import re
 import time
 import os
 import zipfile
 import yt_dlp
-import random
+import itertools
+import threading
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import functools
+import hashlib
+import diskcache
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 # API 키를 st.secrets에서 가져오기
 SERPAPI_API_KEY = st.secrets["SERPAPI_API_KEY"]
 YOUTUBE_API_KEYS = st.secrets["YOUTUBE_API_KEYS"]
 
+# YouTube API 키별 일일 할당량(유닛) 및 사용 중단 기준
+YOUTUBE_DAILY_QUOTA = 10000
+YOUTUBE_QUOTA_THRESHOLD = 9500
+
+# API 호출별 할당량 비용
+YOUTUBE_API_COST = {
+    "search": 100,
+    "videos": 1
+}
+
+@st.cache_resource
+def get_key_state():
+    """키 순환 및 키별 사용량 기록 (스크립트 재실행 시에도 유지, 할당량은 태평양 시간 자정에 초기화)"""
+    return {
+        "iter": itertools.cycle(YOUTUBE_API_KEYS),
+        "units": {key: 0 for key in YOUTUBE_API_KEYS},
+        "date": None,
+        "lock": threading.Lock()
+    }
+
 def get_youtube_api_key():
-    """YouTube API 키를 순환하여 사용"""
-    return random.choice(YOUTUBE_API_KEYS)
+    """할당량이 남은 YouTube API 키를 순환하여 사용 (모두 소진 시 None)"""
+    state = get_key_state()
+    with state["lock"]:
+        today = datetime.now(ZoneInfo("America/Los_Angeles")).date()
+        if state["date"] != today:
+            state["date"] = today
+            for key in state["units"]:
+                state["units"][key] = 0
+
+        for _ in range(len(YOUTUBE_API_KEYS)):
+            key = next(state["iter"])
+            if state["units"][key] <= YOUTUBE_QUOTA_THRESHOLD:
+                return key
+        return None
+
+def record_youtube_api_usage(key, units):
+    """키별 사용량 기록"""
+    state = get_key_state()
+    with state["lock"]:
+        state["units"][key] += units
+
+@st.cache_resource
+def get_http_client():
+    """공용 HTTP 클라이언트 (HTTP/2 및 연결 재사용, 스크립트 재실행 시에도 유지)"""
+    client = httpx.Client(
+        http2=True,
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+    )
+    atexit.register(client.close)
+    return client
+
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3"
+
+# 일시적인 오류로 보고 재시도할 HTTP 상태 코드
+RETRYABLE_STATUS_CODES = {429, 500, 503}
+
+class QuotaExhausted(Exception):
+    """YouTube API 키의 할당량 소진"""
+
+def is_retryable_error(exc):
+    """재시도 대상 오류 여부 (429/5xx 응답 또는 네트워크 오류)"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+@retry(
+    retry=retry_if_exception(is_retryable_error),
+    wait=wait_exponential_jitter(initial=1, max=10),
+    stop=stop_after_attempt(4),
+    reraise=True
+)
+def youtube_api_request(resource, params, key):
+    """YouTube Data API 단일 요청 (일시적 오류는 지수 백오프로 재시도)"""
+    response = get_http_client().get(
+        f"{YOUTUBE_API_URL}/{resource}",
+        params={**params, "key": key},
+        timeout=10
+    )
+    if response.status_code == 403 and "quotaExceeded" in response.text:
+        raise QuotaExhausted(f"할당량 소진: {resource}")
+
+    response.raise_for_status()
+    return response.json()
+
+def youtube_api_get(resource, params):
+    """YouTube Data API REST 호출 (할당량 초과 시 다음 키로 재시도)"""
+    for _ in range(len(YOUTUBE_API_KEYS)):
+        key = get_youtube_api_key()
+        if key is None:
+            break
+
+        try:
+            data = youtube_api_request(resource, params, key)
+        except QuotaExhausted:
+            # 소진된 키는 오늘 더 이상 사용하지 않음
+            record_youtube_api_usage(key, YOUTUBE_DAILY_QUOTA)
+            continue
+
+        # 재시도 횟수와 관계없이 성공한 호출 1회분만 기록
+        record_youtube_api_usage(key, YOUTUBE_API_COST[resource])
+        return data
+
+    raise QuotaExhausted("모든 YouTube API 키의 할당량이 소진되었습니다.")
 
 # 국가별 검색어 설정
 COUNTRY_QUERIES = {
@@ -37,66 +146,236 @@ PERIOD_OPTIONS = {
     "최근 1년": 365
 }
 
+# 동시에 실행할 API 요청 수
+MAX_WORKERS = 16
+
+# 키워드별 YouTube 검색 결과 수 (60초 이하 Shorts가 부족하면 최대치로 다시 검색)
+SEARCH_MAX_RESULTS = 25
+SEARCH_MAX_RESULTS_FALLBACK = 50
+
+# 키워드별로 보여줄 Shorts 수
+SHORTS_PER_QUERY = 5
+
+# 동시에 다운로드할 썸네일 수
+THUMBNAIL_WORKERS = 32
+
+# 동시에 다운로드할 영상 수
+DOWNLOAD_WORKERS = 8
+
+# 엑셀에 삽입할 썸네일 크기 (가로, 세로)
+THUMBNAIL_SIZE = (240, 180)
+
+# 엑셀 셀 서식
+_CENTER_FORMAT = {'align': 'center', 'valign': 'vcenter'}
+_CENTER_WRAP_FORMAT = {**_CENTER_FORMAT, 'text_wrap': True}
+_HEADER_FORMAT = {**_CENTER_FORMAT, 'bold': True, 'bg_color': '#CCFFCC', 'border': 1}
+_HEADER_WRAP_FORMAT = {**_HEADER_FORMAT, 'text_wrap': True}
+_LINK_FORMAT = {'font_color': 'blue', 'underline': 1, 'align': 'left', 'valign': 'vcenter', 'text_wrap': True}
+
+@st.cache_resource
+def get_cache():
+    """API 응답 디스크 캐시 (스크립트 재실행 시에도 같은 핸들 유지)"""
+    cache = diskcache.Cache("./.meme_cache")
+    atexit.register(cache.close)
+    return cache
+
+# 검색 기간(일)별 캐시 유지 시간(초)
+CACHE_TTL = {
+    1: 60 * 60,
+    7: 6 * 60 * 60,
+    30: 24 * 60 * 60,
+    365: 24 * 60 * 60
+}
+
+# 프로세스 내 메모리 캐시 유지 시간(초) - 디스크 캐시 앞단에서 재실행 시 디스크 조회도 생략
+MEMORY_CACHE_TTL = 30 * 60
+
+# Google Trends 캐시 유지 시간(초) - 검색 기간과 무관하게 조회되므로 가장 짧은 값 사용
+TRENDS_CACHE_TTL = 60 * 60
+
+# 동영상 상세 정보 캐시 유지 시간(초) - 조회수가 계속 바뀌므로 가장 짧은 값 사용
+VIDEO_CACHE_TTL = 60 * 60
+
+# 썸네일 이미지 캐시 유지 시간(초)
+THUMBNAIL_CACHE_TTL = 24 * 60 * 60
+
+def make_cache_key(*args, **kwargs):
+    """함수 인자로 캐시 키 생성"""
+    return hashlib.sha1(json.dumps((args, kwargs), sort_keys=True).encode()).hexdigest()
+
+def cached(ttl, key=make_cache_key):
+    """함수 결과(API 원본 응답, 썸네일 이미지 등)를 디스크에 캐시하는 데코레이터
+
+    ttl은 초 단위 값 또는 함수 인자를 받아 초를 반환하는 함수
+    _refresh=True로 호출하면 캐시를 읽지 않고 새로 조회한 값으로 덮어씀
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, _refresh=False, **kwargs):
+            cache_key = f"{func.__name__}:{key(*args, **kwargs)}"
+            if not _refresh:
+                value = get_cache().get(cache_key)
+                if value is not None:
+                    return value
+            
+            value = func(*args, **kwargs)
+            expire = ttl(*args, **kwargs) if callable(ttl) else ttl
+            get_cache().set(cache_key, value, expire=expire)
+            return value
+        return wrapper
+    return decorator
+
+def video_cache_key(video_id):
+    """동영상 상세 정보 캐시 키"""
+    return f"video_details:{make_cache_key(video_id)}"
+
+# ISO 8601 동영상 길이 패턴 (예: PT1M30S)
+_DURATION_RE = re.compile(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?')
+
 def parse_iso8601_duration(duration_str):
     """YouTube 동영상 길이를 초 단위로 변환"""
-    pattern = r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?'
-    match = re.match(pattern, duration_str)
-    hours = int(match.group(1)) if match and match.group(1) else 0
-    minutes = int(match.group(2)) if match and match.group(2) else 0
-    seconds = int(match.group(3)) if match and match.group(3) else 0
-    return hours * 3600 + minutes * 60 + seconds
-
-def get_youtube_shorts(search_query, days_ago=365, max_results=5):
-    """YouTube Shorts 검색 함수"""
+    match = _DURATION_RE.match(duration_str)
+    hours, minutes, seconds = match.groups() if match else (None, None, None)
+    return int(hours or 0) * 3600 + int(minutes or 0) * 60 + int(seconds or 0)
+
+@st.cache_data(ttl=MEMORY_CACHE_TTL, show_spinner=False)
+@cached(ttl=lambda search_query, days_ago=365, max_results=SEARCH_MAX_RESULTS: CACHE_TTL[days_ago])
+def youtube_search(search_query, days_ago=365, max_results=SEARCH_MAX_RESULTS):
+    """YouTube Shorts 검색 (원본 응답 반환)"""
+    # 선택된 기간 전 날짜 계산
+    period_ago = (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    
+    # 검색 실행 (ID만 사용하므로 snippet은 요청하지 않음)
+    return youtube_api_get("search", {
+        "q": f"{search_query} #shorts",
+        "part": "id",
+        "maxResults": max_results,
+        "type": "video",
+        "videoDuration": "short",
+        "order": "viewCount",
+        "publishedAfter": period_ago
+    })
+
+def search_video_ids(search_query, days_ago=365, max_results=SEARCH_MAX_RESULTS, refresh=False):
+    """YouTube Shorts 검색 후 동영상 ID 목록 반환 (refresh=True면 캐시를 거치지 않고 새로 검색)"""
     try:
-        youtube = build('youtube', 'v3', developerKey=get_youtube_api_key())
-        
-        # 선택된 기간 전 날짜 계산
-        period_ago = (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%dT%H:%M:%SZ')
-        
-        # 검색 실행
-        search_response = youtube.search().list(
-            q=f"{search_query} #shorts",
-            part="id,snippet",
-            maxResults=50,  # 더 많은 결과를 가져와서 필터링
-            type="video",
-            videoDuration="short",
-            order="viewCount",
-            publishedAfter=period_ago
-        ).execute()
-
-        videos = []
-        video_ids = [item['id']['videoId'] for item in search_response['items']]
-
-        # 비디오 상세 정보 가져오기
-        video_response = youtube.videos().list(
-            part="snippet,statistics,contentDetails",
-            id=','.join(video_ids)
-        ).execute()
-
-        for video in video_response['items']:
-            duration = parse_iso8601_duration(video['contentDetails']['duration'])
-            
-            # 60초 이하 동영상만 필터링
-            if duration <= 60:
-                video_info = {
-                    'title': video['snippet']['title'],
-                    'video_id': video['id'],
-                    'view_count': int(video['statistics'].get('viewCount', 0)),
-                    'like_count': int(video['statistics'].get('likeCount', 0)),
-                    'published_at': video['snippet']['publishedAt'],
-                    'channel_title': video['snippet']['channelTitle'],
-                    'url': f'https://www.youtube.com/watch?v={video["id"]}'
-                }
-                videos.append(video_info)
+        search_response = youtube_search(search_query, days_ago=days_ago, max_results=max_results, _refresh=refresh)
+        return [item['id']['videoId'] for item in search_response['items']]
 
-        # 조회수 기준 상위 5개 반환
-        return sorted(videos, key=lambda x: x['view_count'], reverse=True)[:max_results]
+    except (httpx.HTTPError, QuotaExhausted) as e:
+        print(f"YouTube API 오류: {str(e)}")
+        return []
+
+    except (ValueError, KeyError) as e:
+        # JSON이 아닌 응답 또는 예상과 다른 응답 구조
+        print(f"YouTube API 응답 오류: {str(e)}")
+        return []
 
-    except Exception as e:
+def fetch_video_details(video_ids):
+    """동영상 상세 정보 조회 (최대 50개)"""
+    try:
+        video_response = youtube_api_get("videos", {
+            "part": "snippet,statistics,contentDetails",
+            "id": ','.join(video_ids)
+        })
+        return video_response['items']
+
+    except (httpx.HTTPError, QuotaExhausted) as e:
         print(f"YouTube API 오류: {str(e)}")
         return []
 
+    except (ValueError, KeyError) as e:
+        # JSON이 아닌 응답 또는 예상과 다른 응답 구조
+        print(f"YouTube API 응답 오류: {str(e)}")
+        return []
+
+def hydrate_videos(video_ids, refresh=False):
+    """동영상 ID를 50개씩 묶어 상세 정보를 조회하고 {video_id: video} 형태로 반환
+
+    videos.list 원본 항목을 동영상별로 디스크에 캐시하고, 캐시에 없는 ID만 조회
+    (refresh=True면 캐시를 읽지 않고 모두 새로 조회)
+    """
+    cache = get_cache()
+    videos = {}
+    if not refresh:
+        for video_id in video_ids:
+            video = cache.get(video_cache_key(video_id))
+            if video is not None:
+                videos[video_id] = video
+
+    missing_ids = [video_id for video_id in video_ids if video_id not in videos]
+    chunks = [missing_ids[i:i + 50] for i in range(0, len(missing_ids), 50)]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for items in executor.map(fetch_video_details, chunks):
+            for video in items:
+                videos[video['id']] = video
+                cache.set(video_cache_key(video['id']), video, expire=VIDEO_CACHE_TTL)
+    return videos
+
+def get_youtube_shorts(video_ids, videos, max_results=SHORTS_PER_QUERY):
+    """검색된 동영상 중 60초 이하 Shorts를 조회수 순으로 반환"""
+    shorts = []
+    for video_id in video_ids:
+        video = videos.get(video_id)
+        if video is None:
+            continue
+
+        duration = parse_iso8601_duration(video['contentDetails']['duration'])
+        
+        # 60초 이하 동영상만 필터링
+        if duration <= 60:
+            video_info = {
+                'title': video['snippet']['title'],
+                'video_id': video['id'],
+                'view_count': int(video['statistics'].get('viewCount', 0)),
+                'like_count': int(video['statistics'].get('likeCount', 0)),
+                'published_at': video['snippet']['publishedAt'],
+                'channel_title': video['snippet']['channelTitle'],
+                'url': f'https://www.youtube.com/watch?v={video["id"]}'
+            }
+            shorts.append(video_info)
+
+    # 조회수 기준 상위 N개 반환
+    return sorted(shorts, key=lambda x: x['view_count'], reverse=True)[:max_results]
+
+@st.cache_data(ttl=MEMORY_CACHE_TTL, show_spinner=False)
+@cached(ttl=TRENDS_CACHE_TTL)
+def fetch_trends(country):
+    """SerpAPI로 Google Trends 급상승 검색어 조회"""
+    q = COUNTRY_QUERIES[country]
+    params = {
+        "engine": "google_trends",
+        "q": q["term"],
+        "geo": q["geo"],
+        "hl": q["hl"],
+        "data_type": "RELATED_QUERIES",
+        "api_key": SERPAPI_API_KEY
+    }
+
+    response = get_http_client().get("https://serpapi.com/search.json", params=params, timeout=30.0)
+    response.raise_for_status()
+    return response.json()
+
+@cached(ttl=THUMBNAIL_CACHE_TTL, key=lambda thumb_url: make_cache_key(thumb_url, THUMBNAIL_SIZE))
+def fetch_thumbnail(thumb_url):
+    """썸네일 이미지를 다운로드하여 삽입 크기로 축소 (실패 시 None 반환)"""
+    if not thumb_url or not isinstance(thumb_url, str):
+        return None
+    resp = get_http_client().get(thumb_url, timeout=5.0)
+    if resp.status_code != 200:
+        return None
+    
+    # 엑셀 표시 크기로 줄여서 다시 인코딩
+    im = Image.open(BytesIO(resp.content)).convert("RGB").resize(THUMBNAIL_SIZE, Image.LANCZOS)
+    buf = BytesIO()
+    im.save(buf, "JPEG", quality=80, optimize=True)
+    return buf.getvalue()
+
+def download_video(link, ydl_opts):
+    """yt-dlp로 영상 1개 다운로드"""
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.download([link])
+
 def main():
     # 전체 화면 모드 설정
     st.set_page_config(layout="wide")
@@ -146,6 +425,13 @@ def main():
         index=3  # 기본값: 1년
     )
 
+    force_refresh = st.sidebar.checkbox("🔁 강제 재조회")
+
+    if st.sidebar.button("🧹 캐시 비우기"):
+        get_cache().clear()
+        st.cache_data.clear()
+        st.sidebar.success("캐시를 비웠습니다.")
+
     if st.sidebar.button("분석 시작"):
         results = {}
         youtube_results = {}
@@ -154,51 +440,94 @@ def main():
         progress_bar = st.progress(0)
         status_text = st.empty()
         
-        for idx, country in enumerate(selected_countries):
-            try:
-                q = COUNTRY_QUERIES[country]
-                status_text.text(f"검색 중: {q['term']} ({q['geo']})")
-                
-                # Google Trends API 호출
-                params = {
-                    "engine": "google_trends",
-                    "q": q["term"],
-                    "geo": q["geo"],
-                    "hl": q["hl"],
-                    "data_type": "RELATED_QUERIES",
-                    "api_key": SERPAPI_API_KEY
-                }
-                
-                response = requests.get("https://serpapi.com/search.json", params=params)
-                response.raise_for_status()
-                data = response.json()
-                
-                related_queries = data.get("related_queries", {})
-                rising_queries = related_queries.get("rising", [])[:15] if related_queries.get("rising") else []
-                
-                results[country] = {
-                    "rising_related_queries": [{
-                        "query": item["query"],
-                        "value": item["value"]
-                    } for item in rising_queries]
-                }
-                
-                # YouTube Shorts 검색
-                status_text.text(f"YouTube Shorts 검색 중... ({country})")
+        days_ago = PERIOD_OPTIONS[selected_period]
+        
+        # 강제 재조회 시 메모리 캐시를 비우고 디스크 캐시도 읽지 않음
+        if force_refresh:
+            fetch_trends.clear()
+            youtube_search.clear()
+        
+        # 같은 기간으로 이미 분석한 국가는 세션 결과 재사용
+        if not force_refresh:
+            for country in selected_countries:
+                if st.session_state.results.get(country, {}).get("_period") == selected_period:
+                    results[country] = st.session_state.results[country]
+                    youtube_results[country] = st.session_state.youtube_results.get(country, {})
+        countries_to_fetch = [country for country in selected_countries if country not in results]
+        
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            # Google Trends API 동시 호출
+            status_text.text("Google Trends 검색 중...")
+            trend_futures = {executor.submit(fetch_trends, country, _refresh=force_refresh): country for country in countries_to_fetch}
+            for future in as_completed(trend_futures):
+                country = trend_futures[future]
+                try:
+                    data = future.result()
+                    related_queries = data.get("related_queries", {})
+                    rising_queries = related_queries.get("rising", [])[:15] if related_queries.get("rising") else []
+                    
+                    results[country] = {
+                        "rising_related_queries": [{
+                            "query": item["query"],
+                            "value": item["value"]
+                        } for item in rising_queries],
+                        "_period": selected_period
+                    }
+                except Exception as e:
+                    st.error(f"오류 발생 ({country}): {str(e)}")
+                    results[country] = {"error": str(e)}
+            
+            # 선택한 국가 순서 유지
+            results = {country: results[country] for country in selected_countries}
+            
+            # 모든 국가의 키워드로 YouTube Shorts 동시 검색 (국가 간 중복 키워드는 한 번만 검색)
+            status_text.text("YouTube Shorts 검색 중...")
+            unique_queries = []
+            for country in countries_to_fetch:
+                if "error" in results[country]:
+                    continue
                 youtube_results[country] = {}
-                for item in rising_queries:
-                    shorts_data = get_youtube_shorts(
-                        item["query"],
-                        days_ago=PERIOD_OPTIONS[selected_period]
-                    )
-                    youtube_results[country][item["query"]] = shorts_data
-                
-            except Exception as e:
-                st.error(f"오류 발생 ({country}): {str(e)}")
-                results[country] = {"error": str(e)}
+                for item in results[country]["rising_related_queries"]:
+                    youtube_results[country][item["query"]] = []
+                    unique_queries.append(item["query"])
+            unique_queries = list(dict.fromkeys(unique_queries))
+            search_futures = {executor.submit(search_video_ids, query, days_ago=days_ago, refresh=force_refresh): query for query in unique_queries}
             
             # 진행률 업데이트
-            progress_bar.progress((idx + 1) / len(selected_countries))
+            search_ids = {}
+            for idx, future in enumerate(as_completed(search_futures), start=1):
+                search_ids[search_futures[future]] = future.result()
+                progress_bar.progress(idx / len(search_futures))
+        
+        # 검색된 모든 동영상의 상세 정보를 50개 단위로 한 번에 조회
+        status_text.text("YouTube Shorts 상세 정보 조회 중...")
+        all_ids = list(dict.fromkeys(video_id for ids in search_ids.values() for video_id in ids))
+        videos = hydrate_videos(all_ids, refresh=force_refresh)
+        shorts_by_query = {query: get_youtube_shorts(ids, videos) for query, ids in search_ids.items()}
+        
+        # Shorts가 부족하고 검색 결과가 더 있을 수 있는 키워드만 검색 결과 수를 늘려 다시 조회
+        # (키워드당 검색 1회, 100 유닛이 추가로 소모됨)
+        retry_queries = [
+            query for query, ids in search_ids.items()
+            if len(shorts_by_query[query]) < SHORTS_PER_QUERY and len(ids) >= SEARCH_MAX_RESULTS
+        ]
+        if retry_queries:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                retry_ids = dict(zip(retry_queries, executor.map(
+                    lambda query: search_video_ids(query, days_ago=days_ago, max_results=SEARCH_MAX_RESULTS_FALLBACK, refresh=force_refresh),
+                    retry_queries
+                )))
+            new_ids = list(dict.fromkeys(video_id for ids in retry_ids.values() for video_id in ids if video_id not in videos))
+            videos.update(hydrate_videos(new_ids, refresh=force_refresh))
+            for query, ids in retry_ids.items():
+                # 재검색이 실패해도(빈 목록) 첫 검색 결과는 유지
+                search_ids[query] = list(dict.fromkeys(search_ids[query] + ids))
+                shorts_by_query[query] = get_youtube_shorts(search_ids[query], videos)
+        for country in countries_to_fetch:
+            for query in youtube_results.get(country, {}):
+                youtube_results[country][query] = shorts_by_query[query]
+        
+        progress_bar.progress(1.0)
         
         # 세션 상태 업데이트
         st.session_state.results = results
@@ -210,127 +539,98 @@ def main():
         # 엑셀 다운로드 버튼을 분석 완료 메시지 바로 아래에 배치
         try:
             excel_buffer = BytesIO()
-            with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                # YouTube Shorts 결과 시트 (먼저 작성)
-                youtube_data = []
-                for country, queries in st.session_state.youtube_results.items():
-                    for query, shorts in queries.items():
-                        for short in shorts:
-                            # 썸네일 URL 가져오기
-                            try:
-                                thumbnail_url = f"https://i.ytimg.com/vi/{short['video_id']}/hqdefault.jpg"
-                            except:
-                                thumbnail_url = ""
-
-                            youtube_data.append({
-                                "Country": country,
-                                "Search Query": query,
-                                "Title": short["title"],
-                                "Channel": short["channel_title"],
-                                "Views": short["view_count"],
-                                "Likes": short["like_count"],
-                                "Published Date": datetime.strptime(short["published_at"], "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d"),
-                                "url": short["url"],
-                                "thumbnail_url": thumbnail_url
-                            })
-                
-                df_youtube = pd.DataFrame(youtube_data)
-                df_youtube.to_excel(writer, sheet_name='YouTube Shorts', index=False)
-
-                # Google Trends 결과 시트 (나중에 작성)
-                trends_data = []
-                for country, data in st.session_state.results.items():
-                    for query in data.get("rising_related_queries", []):
-                        trends_data.append({
-                            "Country": country,
-                            "Related Query": query["query"],
-                            "Value": query["value"]
-                        })
-                
-                df_trends = pd.DataFrame(trends_data)
-                df_trends.to_excel(writer, sheet_name='Meme Keyword', index=False)
+            # constant_memory 모드 (in_memory 옵션과 함께 쓰면 비활성화되므로 사용하지 않음)
+            workbook = xlsxwriter.Workbook(excel_buffer, {'constant_memory': True})
+            
+            # 셀 서식 (워크북에 한 번만 등록하고 모든 셀에서 공유)
+            header_format = workbook.add_format(_HEADER_FORMAT)
+            header_wrap_format = workbook.add_format(_HEADER_WRAP_FORMAT)
+            body_format = workbook.add_format(_CENTER_FORMAT)
+            body_wrap_format = workbook.add_format(_CENTER_WRAP_FORMAT)
+            link_format = workbook.add_format(_LINK_FORMAT)
+            
+            # YouTube Shorts 결과 시트 (먼저 작성)
+            youtube_columns = ["Country", "Search Query", "Title", "Channel", "Views", "Likes", "Published Date", "url", "thumbnail_url"]
+            frames = []
+            for country, queries in st.session_state.youtube_results.items():
+                for query, shorts in queries.items():
+                    if not shorts:
+                        continue
+                    df = pd.DataFrame(shorts)
+                    df["Country"] = country
+                    df["Search Query"] = query
+                    frames.append(df)
+            
+            if frames:
+                df_youtube = pd.concat(frames, ignore_index=True)
+                df_youtube["Published Date"] = pd.to_datetime(df_youtube["published_at"], format="%Y-%m-%dT%H:%M:%SZ").dt.strftime("%Y-%m-%d")
+                df_youtube["thumbnail_url"] = "https://i.ytimg.com/vi/" + df_youtube["video_id"] + "/hqdefault.jpg"
+                df_youtube = df_youtube.rename(columns={
+                    "title": "Title",
+                    "channel_title": "Channel",
+                    "view_count": "Views",
+                    "like_count": "Likes"
+                })[youtube_columns]
+            else:
+                df_youtube = pd.DataFrame(columns=youtube_columns)
+            worksheet = workbook.add_worksheet('YouTube Shorts')
+            
+            # 열 너비 및 열 서식 (서식을 지정하지 않은 셀은 열 서식을 따름)
+            worksheet.set_column("A:B", 15, body_format)       # Country, Search Query
+            worksheet.set_column("C:C", 30, body_wrap_format)  # Title
+            worksheet.set_column("D:D", 20, body_wrap_format)  # Channel
+            worksheet.set_column("E:F", 12, body_format)       # Views, Likes
+            worksheet.set_column("G:G", 15, body_format)       # Published Date
+            worksheet.set_column("H:H", 7, body_format)        # URL
+            worksheet.set_column("I:I", 30, body_wrap_format)  # Thumbnail
 
-                # 스타일 적용
-                workbook = writer.book
-                for sheet_name in ['YouTube Shorts', 'Meme Keyword']:
-                    worksheet = writer.sheets[sheet_name]
-                    
-                    # 헤더 스타일
-                    header_fill = PatternFill(start_color="CCFFCC", end_color="CCFFCC", fill_type="solid")
-                    header_font = Font(bold=True)
-                    
-                    for cell in worksheet[1]:
-                        cell.fill = header_fill
-                        cell.font = header_font
+            # 헤더 기록 (결과가 없으면 헤더만 기록하고 나머지 작업 생략)
+            wrap_columns = {"Title", "Channel", "thumbnail_url"}
+            worksheet.set_row(0, 30)
+            for col_idx, column in enumerate(youtube_columns):
+                worksheet.write(0, col_idx, column, header_wrap_format if column in wrap_columns else header_format)
+            
+            if not df_youtube.empty:
+                # 썸네일 이미지 동시 다운로드
+                with ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS) as executor:
+                    thumb_futures = [executor.submit(fetch_thumbnail, url) for url in df_youtube["thumbnail_url"]]
+
+                # 데이터 행 기록 (constant_memory 모드에서는 행 순서대로 기록해야 함)
+                url_col = youtube_columns.index("url")
+                thumb_col = youtube_columns.index("thumbnail_url")
+                for row_idx, (values, future) in enumerate(zip(df_youtube.itertuples(index=False), thumb_futures), start=1):
+                    worksheet.set_row(row_idx, 135)
+                    worksheet.write_row(row_idx, 0, values)
                     
-                    # 전체 셀 중앙 정렬
-                    for row in worksheet.iter_rows():
-                        for cell in row:
-                            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-                    # 열 너비 조정
-                    if sheet_name == 'YouTube Shorts':
-                        # 기본 열 너비 설정
-                        for col_letter in ["A", "B"]:  # Country, Search Query
-                            worksheet.column_dimensions[col_letter].width = 15
-                        worksheet.column_dimensions["C"].width = 30  # Title
-                        worksheet.column_dimensions["D"].width = 20  # Channel
-                        for col_letter in ["E", "F"]:  # Views, Likes
-                            worksheet.column_dimensions[col_letter].width = 12
-                        worksheet.column_dimensions["G"].width = 15  # Published Date
-                        worksheet.column_dimensions["H"].width = 7   # URL
-                        worksheet.column_dimensions["I"].width = 30  # Thumbnail
-
-                        # 행 높이 조정
-                        worksheet.row_dimensions[1].height = 30
-                        for row_idx in range(2, len(df_youtube) + 2):
-                            worksheet.row_dimensions[row_idx].height = 135
-
-                        # 썸네일 이미지 삽입
-                        for i, row in df_youtube.iterrows():
-                            try:
-                                cell_row = i + 2  # 2행부터 시작
-                                thumb_url = row["thumbnail_url"]
-                                if thumb_url and isinstance(thumb_url, str):
-                                    resp = requests.get(thumb_url, timeout=5)
-                                    if resp.status_code == 200:
-                                        img_data = BytesIO(resp.content)
-                                        img = OpxImage(img_data)
-                                        img.width = 240
-                                        img.height = 180
-                                        worksheet.add_image(img, f"I{cell_row}")
-                            except Exception as e:
-                                st.warning(f"이미지 삽입 실패 (행 {cell_row}): {str(e)}")
-                                continue  # 이미지 삽입 실패 시 건너뛰기
-
-                        # URL 열에 하이퍼링크 설정
-                        for row_idx in range(2, len(df_youtube) + 2):
-                            try:
-                                cell = worksheet[f"H{row_idx}"]
-                                if cell.value and isinstance(cell.value, str) and cell.value.startswith("http"):
-                                    cell.hyperlink = cell.value
-                                    cell.style = "Hyperlink"
-                                    cell.alignment = Alignment(horizontal="left", vertical="center", wrapText=True)
-                            except Exception as e:
-                                continue
-
-                        # 특정 열에 줄바꿈 적용
-                        for col_letter in ["C", "D", "I"]:  # Title, Channel, Thumbnail
-                            for row_idx in range(1, worksheet.max_row + 1):
-                                try:
-                                    cell = worksheet[f"{col_letter}{row_idx}"]
-                                    current_alignment = cell.alignment
-                                    new_alignment = Alignment(
-                                        horizontal=current_alignment.horizontal if current_alignment else "center",
-                                        vertical=current_alignment.vertical if current_alignment else "center",
-                                        wrapText=True
-                                    )
-                                    cell.alignment = new_alignment
-                                except Exception as e:
-                                    continue
-
-            # 워크북과 관련된 모든 작업이 with 블록 안에서 완료됨
-            # (명시적인 save나 close 호출 제거)
+                    # URL 열에 하이퍼링크 설정
+                    url = values[url_col]
+                    if url and isinstance(url, str) and url.startswith("http"):
+                        worksheet.write_url(row_idx, url_col, url, link_format)
+
+                    # 썸네일 이미지 삽입 (동일한 이미지는 xlsxwriter가 한 번만 저장)
+                    try:
+                        thumb_data = future.result()
+                        if thumb_data:
+                            worksheet.insert_image(row_idx, thumb_col, "thumbnail.jpg", {'image_data': BytesIO(thumb_data)})
+                    except Exception as e:
+                        st.warning(f"이미지 삽입 실패 (행 {row_idx + 1}): {str(e)}")
+                        continue  # 이미지 삽입 실패 시 건너뛰기
+
+            # Google Trends 결과 시트 (나중에 작성)
+            trends_columns = ["Country", "Related Query", "Value"]
+            trends_data = []
+            for country, data in st.session_state.results.items():
+                for query in data.get("rising_related_queries", []):
+                    trends_data.append([country, query["query"], query["value"]])
+            
+            worksheet = workbook.add_worksheet('Meme Keyword')
+            worksheet.set_column("A:C", None, body_format)
+            worksheet.write_row(0, 0, trends_columns, header_format)
+            for row_idx, values in enumerate(trends_data, start=1):
+                worksheet.write_row(row_idx, 0, values)
+
+            # constant_memory 모드는 행을 기록하는 즉시 임시 파일로 내보내고, close 시 버퍼에 저장
+            workbook.close()
 
             st.download_button(
                 label="결과 Excel 파일 다운로드",
@@ -424,17 +724,12 @@ def main():
                 
                 # yt-dlp 옵션 설정
                 ydl_opts = {
-                    'format': 'bestvideo[ext=mp4][vcodec^=avc]+bestaudio[ext=m4a]/best[ext=mp4]',
-                    'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
-                    'merge_output_format': 'mp4',
+                    'format': 'best[ext=mp4][height<=720]/best[ext=mp4]/best',  # 음성이 포함된 단일 mp4 (ffmpeg 병합 불필요)
+                    'outtmpl': os.path.join(download_dir, '%(title)s [%(id)s].%(ext)s'),  # 동시 다운로드 시 파일명 충돌 방지
                     'http_headers': {
                         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36'
                     },
                     'force-ipv4': True,
-                    'postprocessors': [{
-                        'key': 'FFmpegVideoConvertor',
-                        'preferedformat': 'mp4'
-                    }],
                 }
                 
                 # 다운로드 진행
@@ -442,16 +737,17 @@ def main():
                 downloaded_count = 0
                 progress_bar = st.progress(0)
                 
-                for idx, link in enumerate(video_links, start=1):
-                    try:
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            ydl.download([link])
-                        downloaded_count += 1
-                    except Exception as e:
-                        failed_list.append({"url": link, "error_msg": str(e)})
-                    
-                    progress_percent = int(idx / num_videos * 100)
-                    progress_bar.progress(progress_percent)
+                with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+                    futures = {executor.submit(download_video, link, ydl_opts): link for link in video_links}
+                    for idx, future in enumerate(as_completed(futures), start=1):
+                        try:
+                            future.result()
+                            downloaded_count += 1
+                        except Exception as e:
+                            failed_list.append({"url": futures[future], "error_msg": str(e)})
+                        
+                        progress_percent = int(idx / num_videos * 100)
+                        progress_bar.progress(progress_percent)
                 
                 st.success(f"다운로드 완료: 총 {num_videos}개 중 {downloaded_count}개 성공")
                 
@@ -462,26 +758,25 @@ def main():
                     with st.expander("다운로드 실패 목록"):
                         st.dataframe(df_failed)
                 
-                # ZIP 파일 생성
+                # ZIP 파일을 메모리에서 생성 (mp4는 이미 압축되어 있으므로 무압축 저장)
                 zip_file_name = f"youtube_videos_{timestamp}.zip"
-                with zipfile.ZipFile(zip_file_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                zip_buffer = BytesIO()
+                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zipf:
                     for root, dirs, files in os.walk(download_dir):
                         for file in files:
                             file_path = os.path.join(root, file)
                             zipf.write(file_path, arcname=file)
                 
                 # ZIP 파일 다운로드 버튼
-                with open(zip_file_name, "rb") as f:
-                    st.download_button(
-                        label="ZIP 파일 다운로드",
-                        data=f,
-                        file_name=zip_file_name,
-                        mime="application/zip"
-                    )
+                st.download_button(
+                    label="ZIP 파일 다운로드",
+                    data=zip_buffer.getvalue(),
+                    file_name=zip_file_name,
+                    mime="application/zip"
+                )
                 
-                # 임시 파일/폴더 정리
+                # 임시 폴더 정리
                 try:
-                    os.remove(zip_file_name)
                     for f_name in os.listdir(download_dir):
                         os.remove(os.path.join(download_dir, f_name))
                     os.rmdir(download_dir)